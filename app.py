@@ -16,7 +16,14 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from io import BytesIO
+import hmac
+import os
 import re
+import sqlite3
+import uuid
+
+from customer_search import CustomerSearchIndex
+from disbursal import DisbursalQueue, DisbursalDispatcher, SQLiteLedger
 
 
 def is_yes(text: str) -> bool:
@@ -156,6 +163,31 @@ CREDIT_SCORES = {
     "JJUPJ9012T": 755
 }
 
+# ==================== CUSTOMER SEARCH ====================
+
+CUSTOMER_INDEX = CustomerSearchIndex(CRM_DATABASE)
+
+# Back-office endpoints are disabled unless a key is configured
+BACKOFFICE_API_KEY = os.environ.get("BACKOFFICE_API_KEY")
+
+def upsert_customer(record, old_phone=None):
+    """Write a customer to the CRM and the search index. Records must be
+    changed through here; in-place edits to CRM_DATABASE are not re-indexed."""
+    record = dict(record)
+    if old_phone and old_phone != record["phone"]:
+        CRM_DATABASE.pop(old_phone, None)
+    CRM_DATABASE[record["phone"]] = record
+    CUSTOMER_INDEX.update(record, old_phone=old_phone)
+    return record
+
+def remove_customer(phone):
+    CRM_DATABASE.pop(phone, None)
+    return CUSTOMER_INDEX.remove(phone)
+
+def backoffice_authorized():
+    supplied = request.headers.get("X-Backoffice-Key", "")
+    return bool(BACKOFFICE_API_KEY) and hmac.compare_digest(supplied, BACKOFFICE_API_KEY)
+
 # ==================== AGENT RESPONSES ====================
 
 def sales_agent_response(customer_name, loan_amount, tenure_months, purpose):
@@ -310,6 +342,7 @@ class LoanApplication:
         self.emi = 0
         self.salary_verified = False
         self.monthly_salary = 0
+        self.application_id = None
 
     def to_dict(self):
         return {
@@ -319,16 +352,50 @@ class LoanApplication:
             "loan_amount": self.loan_amount,
             "tenure": self.tenure,
             "emi": self.emi,
+            "application_id": self.application_id,
+            "disbursal": DISBURSAL_QUEUE.status(self.application_id) if self.application_id else None,
             "messages": self.messages
         }
 
 app_sessions = {}
 
+# ==================== DISBURSAL ====================
+
+DISBURSAL_QUEUE = DisbursalQueue(os.environ.get("DISBURSAL_DB", "disbursal.db"))
+LEDGER = SQLiteLedger(os.environ.get("LEDGER_DB", "ledger.db"))
+DISBURSAL_DISPATCHER = DisbursalDispatcher(
+    DISBURSAL_QUEUE,
+    LEDGER,
+    batch_size=int(os.environ.get("DISBURSAL_BATCH_SIZE", 50)),
+    max_batch_age=float(os.environ.get("DISBURSAL_MAX_BATCH_AGE", 5.0)),
+)
+DISBURSAL_AUTOSTART = os.environ.get("DISBURSAL_AUTOSTART", "1") == "1"
+
+def queue_disbursal(app_data):
+    # The session only records the id once the queue row exists
+    application_id = app_data.application_id or f"APP{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    disbursal = DISBURSAL_QUEUE.enqueue(
+        application_id,
+        app_data.loan_amount,
+        customer_phone=app_data.customer['phone'],
+        tenure=app_data.tenure
+    )
+    app_data.application_id = application_id
+    return disbursal
+
 # ==================== FLASK APP ====================
 
 app = Flask(__name__)
 CORS(app)
 
+@app.before_request
+def ensure_disbursal_dispatcher():
+    # Started from the serving process on its first request, so it runs under
+    # `flask run` and WSGI servers alike, while the debug reloader's watcher
+    # process (which never serves) does not start a second dispatcher.
+    if DISBURSAL_AUTOSTART:
+        DISBURSAL_DISPATCHER.start()
+
 def extract_phone_number(text):
     match = re.search(r'\b\d{10}\b', text)
     return match.group(0) if match else None
@@ -432,10 +499,19 @@ def chat():
             )
             next_stage = "sales"
         elif phone:
-            agent_response = (
-                f"No customer record was found for {phone}.\n"
-                "Please re-enter the registered mobile number, or use an existing customer number."
-            )
+            # Only say that a close match exists: echoing any of its digits would
+            # let an anonymous user reconstruct other customers' numbers.
+            if CUSTOMER_INDEX.suggest_phone(phone, limit=1):
+                agent_response = (
+                    f"No customer record was found for {phone}.\n\n"
+                    "A registered number differing by one or two digits exists. "
+                    "Please check for a mistyped or swapped digit and re-enter your registered mobile number."
+                )
+            else:
+                agent_response = (
+                    f"No customer record was found for {phone}.\n"
+                    "Please re-enter the registered mobile number, or use an existing customer number."
+                )
         else:
             agent_response = "Please provide a valid 10-digit mobile number to proceed with your application."
 
@@ -556,11 +632,51 @@ def chat():
         else:
             agent_response = "Would you like me to generate and share your sanction letter now? Reply \"yes\" to proceed."
 
+    elif app_data.stage == "completed" and not (
+        app_data.application_id and DISBURSAL_QUEUE.status(app_data.application_id)
+    ):
+        if is_yes(user_message) or text_lower.strip() in ["accept", "i accept"]:
+            try:
+                queue_disbursal(app_data)
+            except sqlite3.Error:
+                agent_response = (
+                    "We could not record your acceptance right now due to a temporary issue.\n"
+                    "Please reply \"accept\" again in a moment."
+                )
+            else:
+                agent_response = (
+                    "Thank you for accepting the sanction letter.\n\n"
+                    f"Your disbursal request has been registered (application ID {app_data.application_id}). "
+                    "Funds will be disbursed to your registered bank account subject to final checks.\n\n"
+                    "If you need any further assistance, you can continue to chat here."
+                )
+        else:
+            agent_response = (
+                "Thank you for choosing Non-Banking Financial Company.\n\n"
+                "Your loan has been sanctioned in principle. After you review and digitally accept the sanction letter, "
+                "funds will be disbursed to your registered bank account subject to final checks.\n\n"
+                "Reply \"accept\" to confirm your acceptance of the sanction letter and proceed towards disbursal."
+            )
+
     elif app_data.stage == "completed":
+        disbursal = DISBURSAL_QUEUE.status(app_data.application_id)
+        if disbursal["status"] == "disbursed":
+            disbursal_note = (
+                f"Funds of ₹{disbursal['amount']:,} have been posted for disbursal "
+                f"(reference {disbursal['ledger_ref']}) to your registered bank account."
+            )
+        elif disbursal["status"] == "failed":
+            disbursal_note = (
+                "Your disbursal could not be processed automatically and has been referred to our operations team."
+            )
+        else:
+            disbursal_note = (
+                "You have accepted the sanction letter; your disbursal request is queued and funds will be "
+                "disbursed to your registered bank account subject to final checks."
+            )
         agent_response = (
             "Thank you for choosing Non-Banking Financial Company.\n\n"
-            "Your loan has been sanctioned in principle. After you review and digitally accept the sanction letter, "
-            "funds will be disbursed to your registered bank account subject to final checks.\n\n"
+            f"Your loan has been sanctioned in principle. {disbursal_note}\n\n"
             "If you need any further assistance, you can continue to chat here."
         )
 
@@ -673,5 +789,63 @@ def get_status(session_id):
     app_data = app_sessions[session_id]
     return jsonify(app_data.to_dict())
 
+@app.route('/api/disbursals/requeue', methods=['POST'])
+def requeue_disbursals():
+    if not backoffice_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json(silent=True) or {}
+    application_ids = data.get("application_ids")
+    if application_ids is not None and not isinstance(application_ids, list):
+        return jsonify({"error": "application_ids must be a list"}), 400
+    return jsonify({"requeued": DISBURSAL_QUEUE.requeue_failed(application_ids)})
+
+@app.route('/api/customers/search', methods=['GET'])
+def search_customers():
+    if not backoffice_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Query parameter 'q' is required"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    found = CUSTOMER_INDEX.search(query, limit=limit)
+    return jsonify({
+        "query": query,
+        "results": found["results"],
+        "truncated": found["truncated"],
+        "fuzzy": found["fuzzy"]
+    })
+
+@app.route('/api/customers/<phone>', methods=['PUT'])
+def put_customer(phone):
+    if not backoffice_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "JSON body required"}), 400
+
+    existing = CRM_DATABASE.get(phone)
+    record = {**(existing or {"phone": phone, "existing_loans": []}), **data}
+    record["phone"] = str(record["phone"])
+    if not re.fullmatch(r"\d{10}", record["phone"]):
+        return jsonify({"error": "Phone must be 10 digits"}), 400
+    if not record.get("name"):
+        return jsonify({"error": "Name is required"}), 400
+    if record["phone"] != phone and record["phone"] in CRM_DATABASE:
+        return jsonify({"error": "Phone already registered"}), 409
+
+    record = upsert_customer(record, old_phone=phone if existing else None)
+    return jsonify(record), (200 if existing else 201)
+
+@app.route('/api/customers/<phone>', methods=['DELETE'])
+def delete_customer(phone):
+    if not backoffice_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    if not remove_customer(phone):
+        return jsonify({"error": "Customer not found"}), 404
+    return jsonify({"deleted": phone})
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
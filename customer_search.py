@@ -0,0 +1,373 @@
+"""
+CUSTOMER SEARCH INDEX - back-office lookup over CRM records
+In-memory prefix index with typo tolerance and incremental updates
+
+Every field keeps its vocabulary in sorted lists bucketed by token length, so
+a prefix query walks its matches best-score-first (exact token, then shorter
+tokens, then lighter fields) and stops once the top results are settled
+instead of scoring every hit. Typos are handled by probing the one-edit
+neighbourhood of a query term against the same sorted vocabulary, and
+mistyped mobile numbers by probing their digit neighbourhood against the
+registered phones; neither probe grows with the size of the book.
+"""
+
+import heapq
+import re
+import string
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+# ==================== TUNING ====================
+
+MIN_PREFIX_LEN = 2          # shorter terms match too much to be useful
+MIN_FUZZY_LEN = 4           # shorter terms are not typo-corrected
+MAX_CANDIDATES = 2000       # records scored per query before results are marked truncated
+SELECTIVITY_SAMPLE = 256    # vocabulary tokens counted per term when picking the driver
+FUZZY_PENALTY = 0.5         # score multiplier for one-edit matches
+
+FIELD_WEIGHTS = {
+    "phone": 4.0,
+    "pan": 4.0,
+    "name": 3.0,
+    "city": 1.5,
+}
+FUZZY_FIELDS = ("name", "city")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_ALPHABET = string.ascii_lowercase + string.digits
+_PREFIX_END = "\x7f"        # sorts after every token character
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+def edits1(term, alphabet=_ALPHABET):
+    """All strings one deletion, transposition, substitution or insertion away."""
+    splits = [(term[:i], term[i:]) for i in range(len(term) + 1)]
+    variants = {left + right[1:] for left, right in splits if right}
+    variants |= {left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1}
+    variants |= {left + c + right[1:] for left, right in splits if right for c in alphabet}
+    variants |= {left + c + right for left, right in splits for c in alphabet}
+    variants.discard(term)
+    return variants
+
+
+def phone_edits1(phone):
+    """Numbers one wrong digit or one adjacent transposition away."""
+    for i, digit in enumerate(phone):
+        for c in string.digits:
+            if c != digit:
+                yield phone[:i] + c + phone[i + 1:]
+    for i in range(len(phone) - 1):
+        if phone[i] != phone[i + 1]:
+            yield phone[:i] + phone[i + 1] + phone[i] + phone[i + 2:]
+
+
+def match_score(field, prefix_len, token_len, penalty=1.0):
+    weight = FIELD_WEIGHTS[field] * penalty
+    return weight * 2 if token_len == prefix_len else weight * prefix_len / token_len
+
+
+def _prefix_range(tokens, prefix):
+    return bisect_left(tokens, prefix), bisect_left(tokens, prefix + _PREFIX_END)
+
+
+def _has_prefix(tokens, prefix):
+    i = bisect_left(tokens, prefix)
+    return i < len(tokens) and tokens[i].startswith(prefix)
+
+
+def _remove_sorted(tokens, token):
+    i = bisect_left(tokens, token)
+    if i < len(tokens) and tokens[i] == token:
+        del tokens[i]
+
+
+# ==================== INDEX ====================
+
+class CustomerSearchIndex:
+    """Thread-safe: every public method holds the index lock, so a request
+    thread updating a record never runs while another is mid-scan."""
+
+    def __init__(self, records=None):
+        self._lock = threading.RLock()
+        self._postings = {field: {} for field in FIELD_WEIGHTS}              # field -> token -> {phone}
+        self._sorted = {field: [] for field in FIELD_WEIGHTS}                # field -> sorted tokens
+        self._by_length = {field: defaultdict(list) for field in FIELD_WEIGHTS}  # field -> len -> sorted tokens
+        self._docs = {}                      # phone -> {field: (tokens...)}
+        self._records = {}                   # phone -> copy of the customer record
+        if records:
+            self._bulk_load(records.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._docs)
+
+    def __contains__(self, phone):
+        with self._lock:
+            return phone in self._docs
+
+    def get(self, phone):
+        with self._lock:
+            record = self._records.get(phone)
+            return dict(record) if record is not None else None
+
+    # ---------- incremental maintenance ----------
+
+    def add(self, record):
+        """Index a copy of `record`, replacing any entry with the same phone."""
+        record = dict(record)
+        phone = str(record["phone"])
+        fields = self._tokenize_record(record)
+        with self._lock:
+            self._remove(phone)
+            for field, tokens in fields.items():
+                for token in tokens:
+                    self._link(field, token, phone)
+            self._docs[phone] = fields
+            self._records[phone] = record
+
+    def update(self, record, old_phone=None):
+        with self._lock:
+            if old_phone is not None and old_phone != str(record["phone"]):
+                self._remove(old_phone)
+            self.add(record)
+
+    def remove(self, phone):
+        with self._lock:
+            return self._remove(phone)
+
+    # ---------- queries ----------
+
+    def search(self, query, limit=10):
+        """Top `limit` customers matching every query term by prefix.
+
+        A 10-digit query with no match falls back to `suggest_phone`, and text
+        terms with no match are retried with one-edit typo matching. Returns
+        {"results", "truncated", "fuzzy"}; `truncated` is set when the
+        candidate budget ran out before the top results were settled.
+        """
+        terms = [t for t in tokenize(query) if len(t) >= MIN_PREFIX_LEN]
+        if not terms or limit <= 0:
+            return {"results": [], "truncated": False, "fuzzy": False}
+
+        with self._lock:
+            ranked, truncated = self._rank(terms, limit, fuzzy=False)
+            fuzzy = False
+            if not ranked:
+                if len(terms) == 1 and terms[0].isdigit() and len(terms[0]) == 10:
+                    return {"results": self.suggest_phone(terms[0], limit=limit), "truncated": False, "fuzzy": True}
+                if any(len(t) >= MIN_FUZZY_LEN and not t.isdigit() for t in terms):
+                    ranked, truncated = self._rank(terms, limit, fuzzy=True)
+                    fuzzy = True
+
+            return {
+                "results": [self._result(phone, score) for score, phone in ranked],
+                "truncated": truncated,
+                "fuzzy": fuzzy,
+            }
+
+    def suggest_phone(self, phone, limit=3, max_distance=2):
+        """Registered numbers within `max_distance` digit errors of `phone`."""
+        phone = re.sub(r"\D", "", str(phone))
+        if len(phone) != 10:
+            return []
+
+        with self._lock:
+            found = {}
+            frontier = [phone]
+            for distance in range(1, max_distance + 1):
+                if len(found) >= limit:
+                    break
+                expand = distance < max_distance
+                next_frontier = []
+                for base in frontier:
+                    for candidate in phone_edits1(base):
+                        if candidate in self._docs and candidate != phone and candidate not in found:
+                            found[candidate] = distance
+                        if expand:
+                            next_frontier.append(candidate)
+                frontier = next_frontier
+
+            ranked = sorted(found.items(), key=lambda item: (item[1], item[0]))[:limit]
+            return [self._result(candidate, 1.0 / (1 + distance)) for candidate, distance in ranked]
+
+    # ---------- internals ----------
+
+    def _remove(self, phone):
+        fields = self._docs.pop(phone, None)
+        if fields is None:
+            return False
+        self._records.pop(phone, None)
+        for field, tokens in fields.items():
+            for token in tokens:
+                self._unlink(field, token, phone)
+        return True
+
+    @staticmethod
+    def _tokenize_record(record):
+        return {field: tuple(dict.fromkeys(tokenize(record.get(field, "")))) for field in FIELD_WEIGHTS}
+
+    def _bulk_load(self, records):
+        latest = {str(record["phone"]): dict(record) for record in records}
+        for phone, record in latest.items():
+            fields = self._tokenize_record(record)
+            for field, tokens in fields.items():
+                postings = self._postings[field]
+                for token in tokens:
+                    phones = postings.get(token)
+                    if phones is None:
+                        postings[token] = {phone}
+                    else:
+                        phones.add(phone)
+            self._docs[phone] = fields
+            self._records[phone] = record
+
+        for field, postings in self._postings.items():
+            tokens = sorted(postings)
+            self._sorted[field] = tokens
+            by_length = self._by_length[field]
+            for token in tokens:
+                by_length[len(token)].append(token)
+
+    def _link(self, field, token, phone):
+        postings = self._postings[field]
+        phones = postings.get(token)
+        if phones is None:
+            phones = postings[token] = set()
+            insort(self._sorted[field], token)
+            insort(self._by_length[field][len(token)], token)
+        phones.add(phone)
+
+    def _unlink(self, field, token, phone):
+        postings = self._postings[field]
+        phones = postings.get(token)
+        if phones is None:
+            return
+        phones.discard(phone)
+        if not phones:
+            del postings[token]
+            _remove_sorted(self._sorted[field], token)
+            bucket = self._by_length[field][len(token)]
+            _remove_sorted(bucket, token)
+            if not bucket:
+                del self._by_length[field][len(token)]
+
+    def _matchers(self, term, fuzzy):
+        """(field, prefix, penalty) triples a record token may start with."""
+        matchers = [(field, term, 1.0) for field in FIELD_WEIGHTS]
+        if fuzzy and len(term) >= MIN_FUZZY_LEN and not term.isdigit():
+            for variant in edits1(term):
+                if len(variant) < MIN_PREFIX_LEN:
+                    continue
+                for field in FUZZY_FIELDS:
+                    if _has_prefix(self._sorted[field], variant):
+                        matchers.append((field, variant, FUZZY_PENALTY))
+        return matchers
+
+    def _groups(self, matchers):
+        """Non-empty (score, field, prefix, length, lo, hi) token ranges, best first."""
+        groups = []
+        for field, prefix, penalty in matchers:
+            for length, bucket in self._by_length[field].items():
+                if length < len(prefix):
+                    continue
+                lo, hi = _prefix_range(bucket, prefix)
+                if lo < hi:
+                    groups.append((match_score(field, len(prefix), length, penalty), field, prefix, length, lo, hi))
+        groups.sort(key=lambda g: g[0], reverse=True)
+        return groups
+
+    def _term_score(self, phone, matchers):
+        fields = self._docs[phone]
+        best = 0.0
+        for field, prefix, penalty in matchers:
+            for token in fields[field]:
+                if token.startswith(prefix):
+                    best = max(best, match_score(field, len(prefix), len(token), penalty))
+        return best
+
+    def _most_selective(self, term_groups):
+        """Index of the term matching the fewest records. Each term counts at
+        most SELECTIVITY_SAMPLE tokens and extrapolates from there, and stops
+        early once it is known to match more than the best so far."""
+        if len(term_groups) == 1:
+            return 0
+        best, best_count = 0, float("inf")
+        for i, groups in enumerate(term_groups):
+            total_tokens = sum(g[5] - g[4] for g in groups)
+            count = visited = 0
+            for _score, field, _prefix, length, lo, hi in groups:
+                bucket = self._by_length[field][length]
+                postings = self._postings[field]
+                for j in range(lo, hi):
+                    count += len(postings[bucket[j]])
+                    visited += 1
+                    if count >= best_count or visited >= SELECTIVITY_SAMPLE:
+                        break
+                if count >= best_count or visited >= SELECTIVITY_SAMPLE:
+                    break
+            if count < best_count and visited < total_tokens:
+                count = count * total_tokens / visited
+            if count < best_count:
+                best, best_count = i, count
+        return best
+
+    def _rank(self, terms, limit, fuzzy):
+        """Threshold scan: walk the most selective term's token ranges in score
+        order and stop once no unseen record can enter the top `limit`."""
+        term_matchers = [self._matchers(term, fuzzy) for term in terms]
+        term_groups = [self._groups(matchers) for matchers in term_matchers]
+        if not all(term_groups):
+            return [], False
+        # score each term only against the fields/prefixes that can match it
+        live = [{(g[1], g[2]) for g in groups} for groups in term_groups]
+        term_matchers = [
+            [m for m in matchers if (m[0], m[1]) in pairs]
+            for matchers, pairs in zip(term_matchers, live)
+        ]
+
+        driver = self._most_selective(term_groups)
+        others_ceiling = sum(groups[0][0] for i, groups in enumerate(term_groups) if i != driver)
+
+        heap = []
+        seen = set()
+        for group_score, field, _prefix, length, lo, hi in term_groups[driver]:
+            bound = group_score + others_ceiling
+            if len(heap) == limit and heap[0][0] >= bound:
+                break
+            bucket = self._by_length[field][length]
+            postings = self._postings[field]
+            for i in range(lo, hi):
+                for phone in postings[bucket[i]]:
+                    if phone in seen:
+                        continue
+                    seen.add(phone)
+                    if len(seen) > MAX_CANDIDATES:
+                        return sorted(heap, reverse=True), True
+
+                    score = 0.0
+                    for matchers in term_matchers:
+                        term_score = self._term_score(phone, matchers)
+                        if not term_score:
+                            break
+                        score += term_score
+                    else:
+                        if len(heap) < limit:
+                            heapq.heappush(heap, (score, phone))
+                        elif (score, phone) > heap[0]:
+                            heapq.heapreplace(heap, (score, phone))
+                        if len(heap) == limit and heap[0][0] >= bound:
+                            return sorted(heap, reverse=True), False
+        return sorted(heap, reverse=True), False
+
+    def _result(self, phone, score):
+        record = self._records[phone]
+        return {
+            "phone": phone,
+            "name": record.get("name"),
+            "city": record.get("city"),
+            "score": round(score, 3),
+        }
@@ -0,0 +1,388 @@
+"""
+DISBURSAL PIPELINE - post-sanction queue, batching dispatcher and ledger
+Accepted loans are queued durably in SQLite and posted to the ledger in batches
+
+The dispatcher flushes a batch once it reaches `batch_size` applications or
+its oldest entry is `max_batch_age` seconds old. Every entry carries an
+idempotency key, so a batch retried after a crash or timeout is never booked
+twice by the ledger.
+"""
+
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# ==================== DEFAULTS ====================
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_BATCH_AGE = 5.0     # seconds
+DEFAULT_POLL_INTERVAL = 0.5     # seconds
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 0.5      # seconds, doubled per attempt
+DEFAULT_BACKOFF_CAP = 30.0      # seconds
+DEFAULT_CLAIM_LEASE = 300.0     # seconds a claimed batch may stay in POSTING
+DEFAULT_SWEEP_INTERVAL = 30.0   # seconds between expired-claim sweeps
+DEFAULT_REQUEUE_DELAY = 5.0     # seconds before a failed entry is retried, doubled per attempt
+DEFAULT_REQUEUE_DELAY_CAP = 300.0
+MAX_ATTEMPTS = 5                # non-transient failures before an entry is parked
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+POSTING = "posting"
+DISBURSED = "disbursed"
+FAILED = "failed"
+
+
+class LedgerError(Exception):
+    """Transient ledger/payment failure; the batch may be retried."""
+
+
+def _now():
+    return time.time()
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+# ==================== LEDGER STAND-IN ====================
+
+class SQLiteLedger:
+    """Local stand-in for the core ledger / payment interface."""
+
+    def __init__(self, path="ledger.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                batch_id TEXT NOT NULL,
+                application_id TEXT NOT NULL,
+                customer_phone TEXT,
+                amount INTEGER NOT NULL,
+                posted_at TEXT NOT NULL
+            )
+        """)
+
+    def post_batch(self, batch_id, entries):
+        """Bulk-insert `entries` and return {idempotency_key: ledger_ref}.
+        Keys already on the ledger keep their original reference."""
+        posted_at = datetime.now().isoformat(timespec="seconds")
+        rows = [
+            (e["idempotency_key"], batch_id, e["application_id"], e.get("customer_phone"), e["amount"], posted_at)
+            for e in entries
+        ]
+        keys = [e["idempotency_key"] for e in entries]
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.Error as exc:
+                raise LedgerError(str(exc)) from exc
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO ledger_entries "
+                    "(idempotency_key, batch_id, application_id, customer_phone, amount, posted_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                refs = {}
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    for row in self._conn.execute(
+                        f"SELECT id, idempotency_key FROM ledger_entries WHERE idempotency_key IN ({placeholders})",
+                        chunk,
+                    ):
+                        refs[row["idempotency_key"]] = f"LDG{row['id']:010d}"
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as exc:
+                self._conn.execute("ROLLBACK")
+                raise LedgerError(str(exc)) from exc
+        return refs
+
+
+# ==================== DURABLE QUEUE ====================
+
+class DisbursalQueue:
+    def __init__(self, path="disbursal.db", requeue_delay=DEFAULT_REQUEUE_DELAY,
+                 requeue_delay_cap=DEFAULT_REQUEUE_DELAY_CAP):
+        self.path = path
+        self.requeue_delay = requeue_delay
+        self.requeue_delay_cap = requeue_delay_cap
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS disbursals (
+                application_id TEXT PRIMARY KEY,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                batch_id TEXT,
+                ledger_ref TEXT,
+                last_error TEXT,
+                enqueued_at REAL NOT NULL,
+                claimed_at REAL,
+                next_attempt_at REAL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_disbursals_status ON disbursals (status, enqueued_at)"
+        )
+
+    def enqueue(self, application_id, amount, customer_phone=None, tenure=None):
+        """Queue an accepted application; re-enqueueing is a no-op."""
+        now = _now()
+        payload = json.dumps({"amount": int(amount), "customer_phone": customer_phone, "tenure": tenure})
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO disbursals "
+                "(application_id, idempotency_key, payload, status, enqueued_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (application_id, f"disb-{application_id}", payload, QUEUED, now, now),
+            )
+        return self.status(application_id)
+
+    def status(self, application_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM disbursals WHERE application_id = ?", (application_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        payload = json.loads(row["payload"])
+        return {
+            "status": row["status"],
+            "amount": payload["amount"],
+            "attempts": row["attempts"],
+            "batch_id": row["batch_id"],
+            "ledger_ref": row["ledger_ref"],
+            "last_error": row["last_error"],
+            "enqueued_at": _iso(row["enqueued_at"]),
+            "claimed_at": _iso(row["claimed_at"]),
+            "next_attempt_at": _iso(row["next_attempt_at"]),
+            "updated_at": _iso(row["updated_at"]),
+        }
+
+    def oldest_queued_age(self):
+        """(count, age of oldest) over queued entries that are due to be tried."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(enqueued_at) AS oldest, COUNT(*) AS pending FROM disbursals "
+                "WHERE status = ? AND (next_attempt_at IS NULL OR next_attempt_at <= ?)",
+                (QUEUED, _now()),
+            ).fetchone()
+        if not row["pending"]:
+            return 0, None
+        return row["pending"], _now() - row["oldest"]
+
+    def claim_batch(self, batch_size):
+        """Atomically move up to `batch_size` queued entries to POSTING under
+        a fresh batch id; the claim is leased from `claimed_at`."""
+        batch_id = f"B{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = _now()
+                rows = self._conn.execute(
+                    "SELECT application_id, idempotency_key, payload FROM disbursals "
+                    "WHERE status = ? AND (next_attempt_at IS NULL OR next_attempt_at <= ?) "
+                    "ORDER BY enqueued_at LIMIT ?",
+                    (QUEUED, now, batch_size),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE disbursals SET status = ?, batch_id = ?, claimed_at = ?, updated_at = ? "
+                    "WHERE application_id = ?",
+                    [(POSTING, batch_id, now, now, r["application_id"]) for r in rows],
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        entries = []
+        for r in rows:
+            payload = json.loads(r["payload"])
+            entries.append({
+                "application_id": r["application_id"],
+                "idempotency_key": r["idempotency_key"],
+                "amount": payload["amount"],
+                "customer_phone": payload.get("customer_phone"),
+            })
+        return batch_id, entries
+
+    # Results only apply while the entry is still held by the same claim, so a
+    # dispatcher whose lease expired cannot overwrite a later outcome.
+
+    def mark_disbursed(self, batch_id, refs_by_application):
+        now = _now()
+        self._write_many(
+            "UPDATE disbursals SET status = ?, ledger_ref = ?, last_error = NULL, next_attempt_at = NULL, "
+            "updated_at = ? WHERE application_id = ? AND batch_id = ? AND status = ?",
+            [(DISBURSED, ref, now, app_id, batch_id, POSTING) for app_id, ref in refs_by_application.items()],
+        )
+
+    def mark_failed(self, batch_id, application_ids, error, transient=True):
+        """Return entries to the queue with exponential backoff. Transient
+        ledger outages never park an entry; other failures park it as FAILED
+        once MAX_ATTEMPTS is reached."""
+        now = _now()
+        self._write_many(
+            "UPDATE disbursals SET attempts = attempts + 1, last_error = ?, updated_at = ?, "
+            "next_attempt_at = ? + MIN(?, ? * (1 << MIN(attempts, 20))), "
+            "status = CASE WHEN ? = 0 AND attempts + 1 >= ? THEN ? ELSE ? END "
+            "WHERE application_id = ? AND batch_id = ? AND status = ?",
+            [
+                (error, now, now, self.requeue_delay_cap, self.requeue_delay,
+                 int(transient), MAX_ATTEMPTS, FAILED, QUEUED, app_id, batch_id, POSTING)
+                for app_id in application_ids
+            ],
+        )
+
+    def requeue_failed(self, application_ids=None):
+        """Put parked entries (all of them, or just `application_ids`) back on
+        the queue with a fresh attempt count."""
+        sql = ("UPDATE disbursals SET status = ?, attempts = 0, next_attempt_at = NULL, updated_at = ? "
+               "WHERE status = ?")
+        now = _now()
+        if application_ids is None:
+            return self._write_many(sql, [(QUEUED, now, FAILED)])
+        return self._write_many(sql + " AND application_id = ?", [(QUEUED, now, FAILED, a) for a in application_ids])
+
+    def _write_many(self, sql, rows):
+        """Apply `rows` in one transaction (one WAL commit per batch, not per row)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                changed = self._conn.executemany(sql, rows).rowcount
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        return changed
+
+    def requeue_in_flight(self, lease=DEFAULT_CLAIM_LEASE):
+        """Recover POSTING entries whose claim is older than `lease` seconds,
+        i.e. left behind by a dispatcher that crashed or hung."""
+        now = _now()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE disbursals SET status = ?, updated_at = ? WHERE status = ? AND claimed_at <= ?",
+                (QUEUED, now, POSTING, now - lease),
+            )
+        return cur.rowcount
+
+
+# ==================== DISPATCHER ====================
+
+class DisbursalDispatcher:
+    def __init__(self, queue, ledger, batch_size=DEFAULT_BATCH_SIZE, max_batch_age=DEFAULT_MAX_BATCH_AGE,
+                 poll_interval=DEFAULT_POLL_INTERVAL, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_cap=DEFAULT_BACKOFF_CAP,
+                 claim_lease=DEFAULT_CLAIM_LEASE, sweep_interval=DEFAULT_SWEEP_INTERVAL, sleep=time.sleep):
+        self.queue = queue
+        self.ledger = ledger
+        self.batch_size = batch_size
+        self.max_batch_age = max_batch_age
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.claim_lease = claim_lease
+        self.sweep_interval = sweep_interval
+        self._sleep = sleep
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="disbursal-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        last_sweep = None
+        while not self._stop.is_set():
+            try:
+                if last_sweep is None or _now() - last_sweep >= self.sweep_interval:
+                    self.queue.requeue_in_flight(self.claim_lease)
+                    last_sweep = _now()
+                flushed = self.run_once()
+            except Exception:
+                logger.exception("Disbursal dispatch failed")
+                flushed = 0
+            if not flushed:
+                self._stop.wait(self.poll_interval)
+
+    def batch_ready(self):
+        pending, age = self.queue.oldest_queued_age()
+        return pending >= self.batch_size or (pending > 0 and age >= self.max_batch_age)
+
+    def run_once(self, force=False):
+        """Post one batch if it is full or old enough; returns entries posted."""
+        if not force and not self.batch_ready():
+            return 0
+        batch_id, entries = self.queue.claim_batch(self.batch_size)
+        if not entries:
+            return 0
+
+        app_ids = [e["application_id"] for e in entries]
+        try:
+            refs = self._post_with_retry(batch_id, entries)
+        except LedgerError as exc:
+            self.queue.mark_failed(batch_id, app_ids, str(exc))
+            return 0
+        except Exception as exc:
+            self.queue.mark_failed(batch_id, app_ids, f"{type(exc).__name__}: {exc}", transient=False)
+            raise
+
+        self.queue.mark_disbursed(batch_id, {
+            e["application_id"]: refs[e["idempotency_key"]] for e in entries if e["idempotency_key"] in refs
+        })
+        missing = [e["application_id"] for e in entries if e["idempotency_key"] not in refs]
+        if missing:
+            self.queue.mark_failed(batch_id, missing, "No ledger reference returned", transient=False)
+        return len(entries) - len(missing)
+
+    def drain(self):
+        total = 0
+        while True:
+            posted = self.run_once(force=True)
+            if not posted:
+                return total
+            total += posted
+
+    def _post_with_retry(self, batch_id, entries):
+        attempt = 0
+        while True:
+            try:
+                return self.ledger.post_batch(batch_id, entries)
+            except LedgerError:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = min(self.backoff_cap, self.backoff_base * (2 ** (attempt - 1)))
+                self._sleep(delay * random.uniform(0.5, 1.0))
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py opens its SQLite stores at import time; keep them out of the tree
+_STATE_DIR = tempfile.mkdtemp(prefix="loan-assistant-tests-")
+os.environ.setdefault("DISBURSAL_DB", os.path.join(_STATE_DIR, "disbursal.db"))
+os.environ.setdefault("LEDGER_DB", os.path.join(_STATE_DIR, "ledger.db"))
+os.environ.setdefault("DISBURSAL_AUTOSTART", "0")
@@ -0,0 +1,113 @@
+import re
+import sqlite3
+
+import pytest
+
+import app as loan_app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(loan_app, "BACKOFFICE_API_KEY", "test-key")
+    loan_app.app.config["TESTING"] = True
+    with loan_app.app.test_client() as client:
+        yield client
+    loan_app.app_sessions.clear()
+
+
+def chat(client, session_id, message):
+    return client.post("/api/chat", json={"session_id": session_id, "message": message}).get_json()
+
+
+def test_unknown_phone_hint_reveals_no_registered_digits(client):
+    chat(client, "hint", "I need a loan")
+    reply = chat(client, "hint", "9876543211")["response"]
+    assert "differing by one or two digits" in reply
+    # the only digits echoed back are the ones the user typed
+    assert re.findall(r"\d+", reply) == ["9876543211"]
+
+    reply = chat(client, "hint", "1111111111")["response"]
+    assert "differing" not in reply
+
+
+def test_customer_search_requires_backoffice_key(client):
+    assert client.get("/api/customers/search?q=rahul").status_code == 401
+    assert client.get("/api/customers/search?q=rahul", headers={"X-Backoffice-Key": "wrong"}).status_code == 401
+
+    res = client.get("/api/customers/search?q=rahul", headers={"X-Backoffice-Key": "test-key"})
+    assert res.status_code == 200
+    body = res.get_json()
+    assert body["results"][0]["phone"] == "9876543210"
+    assert body["truncated"] is False
+
+
+def test_customer_mutations_update_search(client):
+    headers = {"X-Backoffice-Key": "test-key"}
+    res = client.put("/api/customers/9000000009", json={"name": "Meera Iyer", "city": "Chennai"}, headers=headers)
+    assert res.status_code == 201
+    try:
+        found = client.get("/api/customers/search?q=meera", headers=headers).get_json()["results"]
+        assert [r["phone"] for r in found] == ["9000000009"]
+
+        res = client.put("/api/customers/9000000009", json={"phone": "9000000010"}, headers=headers)
+        assert res.status_code == 200
+        assert "9000000009" not in loan_app.CRM_DATABASE
+        found = client.get("/api/customers/search?q=meera", headers=headers).get_json()["results"]
+        assert [r["phone"] for r in found] == ["9000000010"]
+    finally:
+        assert client.delete("/api/customers/9000000010", headers=headers).status_code == 200
+    assert client.get("/api/customers/search?q=meera", headers=headers).get_json()["results"] == []
+    assert client.delete("/api/customers/9000000010", headers=headers).status_code == 404
+
+
+def test_disbursal_waits_for_acceptance_and_shows_in_status(client):
+    for message in ["I need a loan", "9876543210", "I need 1 lakh for 3 years for travel", "yes"]:
+        chat(client, "flow", message)
+    assert chat(client, "flow", "confirm")["stage"] == "sanction"
+    assert chat(client, "flow", "yes")["stage"] == "completed"
+
+    status = client.get("/api/status/flow").get_json()
+    assert status["disbursal"] is None
+
+    reply = chat(client, "flow", "tell me more")["response"]
+    assert "digitally accept the sanction letter" in reply
+    assert client.get("/api/status/flow").get_json()["disbursal"] is None
+
+    chat(client, "flow", "accept")
+    status = client.get("/api/status/flow").get_json()
+    assert status["application_id"]
+    assert status["disbursal"]["status"] == "queued"
+    assert status["disbursal"]["amount"] == 100000
+
+    loan_app.DISBURSAL_DISPATCHER.drain()
+    status = client.get("/api/status/flow").get_json()
+    assert status["disbursal"]["status"] == "disbursed"
+    assert status["disbursal"]["ledger_ref"].startswith("LDG")
+
+
+def test_failed_enqueue_leaves_acceptance_open(client, monkeypatch):
+    for message in ["I need a loan", "9876543210", "I need 1 lakh for 3 years for travel", "yes", "confirm", "yes"]:
+        chat(client, "retry", message)
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(loan_app.DISBURSAL_QUEUE, "enqueue", locked)
+        reply = chat(client, "retry", "accept")["response"]
+    assert "could not record your acceptance" in reply
+    assert client.get("/api/status/retry").get_json()["application_id"] is None
+
+    reply = chat(client, "retry", "what next?")["response"]
+    assert "queued" not in reply
+    assert "digitally accept the sanction letter" in reply
+
+    chat(client, "retry", "accept")
+    assert client.get("/api/status/retry").get_json()["disbursal"]["status"] == "queued"
+
+
+def test_requeue_endpoint_requires_backoffice_key(client):
+    assert client.post("/api/disbursals/requeue", json={}).status_code == 401
+    res = client.post("/api/disbursals/requeue", json={"application_ids": ["NONE"]},
+                      headers={"X-Backoffice-Key": "test-key"})
+    assert res.get_json() == {"requeued": 0}
@@ -0,0 +1,133 @@
+import threading
+
+from customer_search import CustomerSearchIndex, MAX_CANDIDATES
+
+
+def customer(phone, name, city="Pune", pan="ABCDE1234F"):
+    return {"phone": phone, "name": name, "city": city, "pan": pan}
+
+
+def phones(found):
+    return [r["phone"] for r in found["results"]]
+
+
+def test_add_update_remove():
+    index = CustomerSearchIndex()
+    index.add(customer("9000000001", "Rahul Kumar", city="Bangalore"))
+    assert phones(index.search("rahul")) == ["9000000001"]
+
+    index.update(customer("9000000001", "Rahul Mehta", city="Delhi"))
+    assert phones(index.search("kumar")) == []
+    assert phones(index.search("mehta delhi")) == ["9000000001"]
+
+    index.update(customer("9000000002", "Rahul Mehta", city="Delhi"), old_phone="9000000001")
+    assert "9000000001" not in index
+    assert phones(index.search("mehta")) == ["9000000002"]
+
+    assert index.remove("9000000002")
+    assert not index.remove("9000000002")
+    assert index.search("mehta")["results"] == []
+    assert len(index) == 0
+
+
+def test_index_keeps_its_own_copy_of_records():
+    record = customer("9000000001", "Rahul Kumar")
+    index = CustomerSearchIndex({record["phone"]: record})
+    record["name"] = "Someone Else"
+    assert index.search("rahul")["results"][0]["name"] == "Rahul Kumar"
+    assert index.search("someone")["results"] == []
+
+
+def test_exact_match_outranks_common_prefix():
+    records = {}
+    for i in range(MAX_CANDIDATES * 2):
+        phone = f"98{i:08d}"
+        records[phone] = customer(phone, f"Rajesh{i}")
+    records["9123456789"] = customer("9123456789", "Raj")
+    index = CustomerSearchIndex(records)
+
+    found = index.search("raj", limit=5)
+    assert found["results"][0]["name"] == "Raj"
+    assert not found["truncated"]
+    scores = [r["score"] for r in found["results"]]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_multi_term_query_requires_every_term():
+    index = CustomerSearchIndex({
+        "9000000001": customer("9000000001", "Rahul Kumar", city="Mumbai"),
+        "9000000002": customer("9000000002", "Rahul Kumar", city="Pune"),
+    })
+    assert phones(index.search("rahul mum")) == ["9000000001"]
+
+
+def test_typo_in_common_name_uses_fuzzy_match():
+    records = {f"98{i:08d}": customer(f"98{i:08d}", f"Rajesh Kumar{i}") for i in range(500)}
+    index = CustomerSearchIndex(records)
+    found = index.search("rjaesh", limit=3)
+    assert found["fuzzy"]
+    assert len(found["results"]) == 3
+    assert all(r["name"].startswith("Rajesh") for r in found["results"])
+
+
+def test_mistyped_phone_falls_back_to_suggestions():
+    index = CustomerSearchIndex({"9876543210": customer("9876543210", "Rahul Kumar")})
+    found = index.search("9876543211")
+    assert found["fuzzy"]
+    assert phones(found) == ["9876543210"]
+
+
+def test_suggest_phone_orders_by_distance():
+    index = CustomerSearchIndex({
+        "9876543210": customer("9876543210", "One Digit"),
+        "9876543201": customer("9876543201", "Transposed"),
+        "9876540000": customer("9876540000", "Far Away"),
+        "1876543210": customer("1876543210", "Two Digits"),
+    })
+    suggested = [r["phone"] for r in index.suggest_phone("9876543211", limit=5)]
+    assert sorted(suggested[:2]) == ["9876543201", "9876543210"]
+    assert suggested[2] == "1876543210"
+    assert "9876540000" not in suggested
+    assert index.suggest_phone("12345") == []
+
+
+def test_results_do_not_expose_pan():
+    index = CustomerSearchIndex({"9000000001": customer("9000000001", "Rahul Kumar", pan="AAUPA1234K")})
+    result = index.search("aaupa")["results"][0]
+    assert result["phone"] == "9000000001"
+    assert "pan" not in result
+
+
+def test_concurrent_updates_do_not_break_searches():
+    records = {f"98{i:08d}": customer(f"98{i:08d}", f"Rajesh{i}") for i in range(2000)}
+    index = CustomerSearchIndex(records)
+    errors = []
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            phone = f"97{i % 500:08d}"
+            index.add(customer(phone, f"Raj{i}", city="Delhi"))
+            index.remove(phone)
+            i += 1
+
+    def reader():
+        try:
+            for _ in range(300):
+                index.search("raj", limit=5)
+                index.search("rajesh1 pune", limit=5)
+                index.suggest_phone("9800000011")
+        except Exception as exc:  # surfaced below; a thread would otherwise swallow it
+            errors.append(exc)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    write_thread = threading.Thread(target=writer)
+    write_thread.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stop.set()
+    write_thread.join()
+    assert errors == []
@@ -0,0 +1,182 @@
+import pytest
+
+import disbursal
+from disbursal import (
+    DISBURSED, FAILED, MAX_ATTEMPTS, POSTING, QUEUED,
+    DisbursalDispatcher, DisbursalQueue, LedgerError, SQLiteLedger,
+)
+
+
+class FakeClock:
+    def __init__(self, start=1_000_000.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+class FlakyLedger:
+    def __init__(self, ledger, failures, error=LedgerError):
+        self.ledger = ledger
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def post_batch(self, batch_id, entries):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("ledger unavailable")
+        return self.ledger.post_batch(batch_id, entries)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(disbursal, "_now", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return DisbursalQueue(str(tmp_path / "disbursal.db"))
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return SQLiteLedger(str(tmp_path / "ledger.db"))
+
+
+def ledger_rows(ledger):
+    return ledger._conn.execute("SELECT COUNT(*) FROM ledger_entries").fetchone()[0]
+
+
+def dispatcher(queue, ledger, sleeps=None, **kwargs):
+    kwargs.setdefault("batch_size", 3)
+    kwargs.setdefault("max_batch_age", 10.0)
+    return DisbursalDispatcher(queue, ledger, sleep=(sleeps.append if sleeps is not None else lambda s: None), **kwargs)
+
+
+def test_enqueue_is_idempotent(queue):
+    first = queue.enqueue("APP1", 100000, customer_phone="9876543210")
+    again = queue.enqueue("APP1", 999999)
+    assert first["status"] == QUEUED
+    assert again["amount"] == 100000
+    assert queue.oldest_queued_age()[0] == 1
+
+
+def test_batch_flushes_when_full(queue, ledger, clock):
+    d = dispatcher(queue, ledger)
+    queue.enqueue("APP1", 100000)
+    queue.enqueue("APP2", 150000)
+    assert d.run_once() == 0
+
+    queue.enqueue("APP3", 200000)
+    assert d.run_once() == 3
+    assert ledger_rows(ledger) == 3
+    status = queue.status("APP2")
+    assert status["status"] == DISBURSED
+    assert status["ledger_ref"].startswith("LDG")
+
+
+def test_batch_flushes_when_old_enough(queue, ledger, clock):
+    d = dispatcher(queue, ledger)
+    queue.enqueue("APP1", 100000)
+    clock.now += 9
+    assert d.run_once() == 0
+    clock.now += 1
+    assert d.run_once() == 1
+    assert queue.status("APP1")["status"] == DISBURSED
+
+
+def test_ledger_ignores_reposted_idempotency_keys(ledger):
+    entry = {"idempotency_key": "disb-APP1", "application_id": "APP1", "amount": 100000}
+    first = ledger.post_batch("B1", [entry])
+    again = ledger.post_batch("B2", [entry, {**entry, "idempotency_key": "disb-APP2", "application_id": "APP2"}])
+    assert again["disb-APP1"] == first["disb-APP1"]
+    assert ledger_rows(ledger) == 2
+
+
+def test_transient_failures_are_retried_with_backoff(queue, ledger, clock):
+    sleeps = []
+    flaky = FlakyLedger(ledger, failures=2)
+    d = dispatcher(queue, flaky, sleeps, batch_size=1, backoff_base=1.0)
+    queue.enqueue("APP1", 100000)
+    assert d.run_once() == 1
+    assert flaky.calls == 3
+    assert len(sleeps) == 2
+    assert 0.5 <= sleeps[0] <= 1.0 and 1.0 <= sleeps[1] <= 2.0
+    assert queue.status("APP1")["status"] == DISBURSED
+
+
+def test_failed_batches_back_off_before_retrying(queue, ledger, clock):
+    d = dispatcher(queue, FlakyLedger(ledger, failures=2), batch_size=1, max_retries=0)
+    queue.enqueue("APP1", 100000)
+    assert d.run_once() == 0
+    assert queue.oldest_queued_age() == (0, None)
+    assert d.run_once(force=True) == 0
+
+    clock.now += queue.requeue_delay
+    assert d.run_once() == 0
+    assert queue.status("APP1")["attempts"] == 2
+
+    clock.now += queue.requeue_delay * 2 - 1
+    assert d.run_once() == 0
+    clock.now += 1
+    assert d.run_once() == 1
+    assert queue.status("APP1")["status"] == DISBURSED
+
+
+def test_ledger_outages_never_park_entries(queue, ledger, clock):
+    d = dispatcher(queue, FlakyLedger(ledger, failures=10 ** 6), batch_size=1, max_retries=0)
+    queue.enqueue("APP1", 100000)
+    for _ in range(MAX_ATTEMPTS * 2):
+        d.run_once()
+        clock.now += queue.requeue_delay_cap
+    status = queue.status("APP1")
+    assert (status["status"], status["attempts"]) == (QUEUED, MAX_ATTEMPTS * 2)
+    assert status["last_error"] == "ledger unavailable"
+
+
+def test_entries_are_parked_after_max_attempts_and_can_be_requeued(queue, ledger, clock):
+    d = dispatcher(queue, FlakyLedger(ledger, failures=MAX_ATTEMPTS, error=ValueError), batch_size=1)
+    queue.enqueue("APP1", 100000)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        with pytest.raises(ValueError):
+            d.run_once()
+        clock.now += queue.requeue_delay_cap
+    status = queue.status("APP1")
+    assert (status["status"], status["attempts"]) == (FAILED, MAX_ATTEMPTS)
+    assert d.run_once(force=True) == 0
+
+    assert queue.requeue_failed(["OTHER"]) == 0
+    assert queue.requeue_failed(["APP1"]) == 1
+    assert d.run_once(force=True) == 1
+    assert queue.status("APP1")["status"] == DISBURSED
+
+
+def test_unexpected_ledger_errors_release_the_claim(queue, ledger, clock):
+    d = dispatcher(queue, FlakyLedger(ledger, failures=1, error=ValueError), batch_size=1)
+    queue.enqueue("APP1", 100000)
+    with pytest.raises(ValueError):
+        d.run_once()
+    status = queue.status("APP1")
+    assert status["status"] == QUEUED
+    assert status["last_error"].startswith("ValueError")
+
+
+def test_requeue_in_flight_only_takes_expired_claims(queue, ledger, clock):
+    queue.enqueue("APP1", 100000)
+    batch_id, entries = queue.claim_batch(10)
+    assert queue.status("APP1")["status"] == POSTING
+
+    clock.now += 60
+    assert queue.requeue_in_flight(lease=300) == 0
+    assert queue.status("APP1")["status"] == POSTING
+
+    clock.now += 300
+    assert queue.requeue_in_flight(lease=300) == 1
+    assert queue.status("APP1")["status"] == QUEUED
+
+    # the stale claim's late result no longer applies once requeued
+    queue.mark_disbursed(batch_id, {"APP1": "LDG0000000001"})
+    assert queue.status("APP1")["status"] == QUEUED